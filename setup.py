@@ -5,7 +5,7 @@ from setuptools import setup, find_packages
 
 ENTRY_POINTS = {
     'console_scripts': [
-        'cs747-parse-uniprot-fasta=cs747.uniprot:import_fasta_to_csv',
+        'cs747-parse-uniprot-fasta=cs747.uniprot:import_fasta',
         'cs747-build-taxonomy-db=cs747.uniprot:build_taxonomy_db',
         'cs747-create-test-data=cs747.uniprot:create_test_data',
         'cs747-label-data=cs747.uniprot:label_sequences',
@@ -37,7 +37,10 @@ setup(
         'PyYAML',
         'biopython',
         'fair-esm',
-        'pandas',
+        'pandas>=2.1',
+        'psutil',
+        'pyarrow>=10.0.1',
+        'requests',
         'torch',
         'torchvision',
     ],
@@ -2,21 +2,49 @@
 
 """
 from collections import namedtuple
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 from functools import cache
 from pathlib import Path
 from pprint import pprint
-from urllib.request import urlopen
+from time import perf_counter_ns
+import csv
+import gzip
 import json
+import os
 import pickle
 import random
+import warnings
 
-from Bio.SeqIO.FastaIO import FastaIterator
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import numpy as np
 import pandas as pd
+import psutil
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+import requests
 
 
-FASTA_FILE_PATH = Path(r"data/uniprot_sprot.fasta")
+FASTA_FILE_PATH = Path(r"data/uniprot_sprot.fasta.gz")
 TAXONOMY_DB_PATH = Path(r'data/taxonomy_db.pickle')
-SEQUENCE_CSV_PATH = Path(r'data/seq.csv')
+LINEAGE_TABLE_PATH = Path(r'data/taxonomy_lineage.parquet')
+SEQUENCE_PATH = Path(r'data/seq.parquet')
+LABELED_CSV_PATH = Path(r'data/labeled_sequences.csv')
+LOOKUP_WORKERS = 16
+LOOKUP_BATCH_SIZE = 200
+# Connect and read timeouts, in seconds, for each Uniprot request.
+LOOKUP_TIMEOUT = (10, 60)
+FASTA_BUFFER_SIZE = 4 * 1024 * 1024
+PICKLE_BUFFER_SIZE = 1024 * 1024
+SOURCE_KEY_METADATA = b'cs747.source_key'
+
+# Old names of module constants, mapped to their replacements.
+_DEPRECATED_CONSTANTS = {
+    'SEQUENCE_CSV_PATH': 'SEQUENCE_PATH',
+}
 
 HeaderFields = namedtuple(
     'HeaderFields',
@@ -30,10 +58,109 @@ HeaderFields = namedtuple(
     ],
 )
 
+_HEADER_PATTERN = (
+    r'(?P<db>[^|]+)\|(?P<unique_id>[^|]+)\|(?P<entry_name>\S+) +'
+    r'(?P<protein_name>.*?) +OS=(?P<organism_name>.*?) +'
+    r'OX=(?P<organism_id>\S+)'
+)
+
+ARROW_STRING_DTYPE = pd.ArrowDtype(pa.large_string())
+
+# Arrow types of the sequence table CSV columns. Without them, a column
+# that is empty in every row would be read as Arrow's null type.
+_SEQUENCE_CSV_TYPES = {
+    name: pa.string()
+    for name in HeaderFields._fields + ('sequence',)
+}
+_SEQUENCE_CSV_TYPES['organism_id'] = pa.int64()
+
+
+def __getattr__(name):
+    """Return deprecated module constants under their old names."""
+    if name in _DEPRECATED_CONSTANTS:
+        new_name = _DEPRECATED_CONSTANTS[name]
+        _warn_renamed(name, new_name)
+        return globals()[new_name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def _warn_renamed(old_name: str, new_name: str) -> None:
+    """Warn that a name is deprecated in favor of a new one."""
+    warnings.warn(
+        f'{old_name} is deprecated, use {new_name} instead',
+        DeprecationWarning,
+        stacklevel=3,
+    )
+
+
+@contextmanager
+def timed(label: str):
+    """Print the wall time and memory use of a block of code.
+
+    Reports the process's resident set size after the block and how
+    much it changed, which shows how much memory the step kept.
+    """
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+    start = perf_counter_ns()
+    yield
+    elapsed_ms = (perf_counter_ns() - start) / 1e6
+    rss_after = process.memory_info().rss
+    rss_mib = rss_after / 2**20
+    delta_mib = (rss_after - rss_before) / 2**20
+    print(f'{label}: {elapsed_ms:.1f} ms, '
+          f'RSS {rss_mib:.1f} MiB ({delta_mib:+.1f} MiB)')
+
+
+def arrow_string_array(values) -> pd.api.extensions.ExtensionArray:
+    """Return an Arrow-backed pandas string array of the given values.
+
+    Arrow stores the strings in one contiguous buffer, rather than as
+    a Python object per value.
+    """
+    result = pd.array(
+        pa.array(values, type=pa.large_string()),
+        dtype=ARROW_STRING_DTYPE,
+    )
+    return result
+
 
 def parse_fasta_header(raw_header: str) -> HeaderFields:
     """Parse a Uniprot FASTA entry header.
 
+    """
+    result = HeaderFields._make(_split_fasta_header(raw_header))
+    return result
+
+
+def _split_fasta_header(raw_header: str) -> tuple:
+    """Split a Uniprot FASTA entry header into a plain tuple of fields.
+
+    The fields are in `HeaderFields` order. Loops over many entries
+    use this to skip building a named tuple per entry.
+    """
+    id_block, _, remaining = raw_header.partition(' ')
+    db, _, ids = id_block.partition('|')
+    uid, _, entry = ids.partition('|')
+    protein, has_os, tail = (' ' + remaining).partition(' OS=')
+    organism, has_ox, tail = tail.partition(' OX=')
+    organism_id = tail.partition(' ')[0]
+
+    if not (entry and has_os and has_ox and organism_id) \
+            or '\t' in raw_header:
+        result = _parse_fasta_header_fallback(raw_header)
+    else:
+        result = (
+            db, uid, entry, protein.strip(' '), organism.strip(' '),
+            organism_id)
+    return result
+
+
+def _parse_fasta_header_fallback(raw_header: str) -> HeaderFields:
+    """Parse a Uniprot FASTA entry header by splitting it.
+
+    Handles headers that the fast header splits cannot, such as fields
+    separated by tabs rather than spaces.
     """
     id_block, remaining = raw_header.split(None, 1)
     db, uid, entry = id_block.split('|')
@@ -48,6 +175,71 @@ def parse_fasta_header(raw_header: str) -> HeaderFields:
     return result
 
 
+def is_gzip_path(path: Path) -> bool:
+    """Return whether a file path names a gzip-compressed file."""
+    result = Path(path).suffix == '.gz'
+    return result
+
+
+def open_fasta(path: Path):
+    """Open a FASTA file for binary reading.
+
+    Files with a '.gz' suffix are decompressed as they are read.
+    """
+    if is_gzip_path(path):
+        result = gzip.open(path, 'rb')
+    else:
+        result = open(path, 'rb', buffering=FASTA_BUFFER_SIZE)
+    return result
+
+
+def iter_fasta_records(handle) -> Iterator[tuple[bytes, bytes]]:
+    """Yield the (title, sequence) of each entry in a binary FASTA file.
+
+    The file is read in large chunks and split into entries at each
+    line starting with '>', so no Python object is built per line.
+    Titles and sequences are returned as undecoded bytes, with the
+    line breaks removed from sequences.
+    """
+    pending = b''
+    while chunk := handle.read(FASTA_BUFFER_SIZE):
+        data = pending + chunk
+        end = data.rfind(b'\n>')
+        if end == -1:
+            pending = data
+        else:
+            yield from _split_fasta_records(data[:end + 1])
+            pending = data[end + 1:]
+    yield from _split_fasta_records(pending)
+
+
+def _split_fasta_records(data: bytes) -> Iterator[tuple[bytes, bytes]]:
+    """Yield (title, sequence) pairs from a run of whole FASTA entries.
+
+    Any text before the first entry is skipped.
+    """
+    records = data.split(b'\n>')
+    if data.startswith(b'>'):
+        records[0] = records[0][1:]
+    else:
+        del records[0]
+
+    for record in records:
+        title, _, body = record.partition(b'\n')
+        yield title.rstrip(), body.translate(None, b' \r\n')
+
+
+def _read_fasta_records(input_dir: Path) -> tuple[list, list]:
+    """Return the titles and sequences of the entries in a FASTA file."""
+    titles = []
+    sequences = []
+    with open_fasta(input_dir) as handle:
+        for title, sequence in iter_fasta_records(handle):
+            titles.append(title)
+            sequences.append(sequence)
+    return titles, sequences
+
+
 def parse_fasta_df(input_dir: Path) -> pd.DataFrame:
     """
     Parse the uniprot fasta data and put it into a Dataframe.
@@ -64,31 +256,69 @@ def parse_fasta_df(input_dir: Path) -> pd.DataFrame:
             * sequence
     """
 
-    data: dict[str, list] = {
-        'db': [],
-        'unique_id': [],
-        'entry_name': [],
-        'protein_name': [],
-        'organism_name': [],
-        'organism_id': [],
-        'sequence': [],
-    }
-
-    with open(input_dir) as handle:
-        for index, value in enumerate(FastaIterator(handle)):
-            fields = parse_fasta_header(value.description)
-            data['db'].append(fields.db)
-            data['unique_id'].append(fields.unique_id)
-            data['entry_name'].append(fields.entry_name)
-            data['protein_name'].append(fields.protein_name)
-            data['organism_name'].append(fields.organism_name)
-            data['organism_id'].append(fields.organism_id)
-            data['sequence'].append(value.seq)
-
-    output = pd.DataFrame(data)
+    titles, sequences = _read_fasta_records(input_dir)
+
+    # Split all of the headers at once, rather than one entry at a time.
+    titles = pd.Series(arrow_string_array(titles))
+    fields = titles.str.extract(_HEADER_PATTERN)
+    unmatched = fields['db'].isna()
+    if unmatched.any():
+        fields[unmatched] = pd.DataFrame(
+            map(_parse_fasta_header_fallback, titles[unmatched]),
+            index=fields.index[unmatched],
+            columns=fields.columns,
+        )
+    fields['db'] = fields['db'].astype('category')
+    fields['organism_name'] = fields['organism_name'].astype('category')
+    fields['organism_id'] = fields['organism_id'].astype('int64')
+
+    output = pd.concat(
+        [fields, pd.Series(arrow_string_array(sequences), name='sequence')],
+        axis=1,
+    )
     return output
 
 
+def fasta_to_csv_stream(input_path: Path, output_path: Path) -> int:
+    """Write Uniprot FASTA entries straight to a sequence CSV file.
+
+    Produces the same columns as `parse_fasta_df`, one row per entry,
+    without holding the parsed data in memory. Returns the number of
+    entries written.
+    """
+    count = 0
+    with open_fasta(input_path) as handle, \
+            open(output_path, 'w', newline='',
+                 buffering=FASTA_BUFFER_SIZE) as output:
+        writer = csv.writer(output, lineterminator='\n')
+        writer.writerow(HeaderFields._fields + ('sequence',))
+        for title, sequence in iter_fasta_records(handle):
+            fields = _split_fasta_header(title.decode())
+            writer.writerow((*fields, sequence.decode()))
+            count += 1
+    return count
+
+
+@cache
+def uniprot_session() -> requests.Session:
+    """Return the HTTP session shared by Uniprot REST queries.
+
+    Reusing one session keeps the connection to Uniprot alive between
+    requests instead of opening a new one per lookup. Requests that
+    fail with a connection error or a rate-limit or server error
+    status are retried with exponential backoff.
+    """
+    retry = Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+    )
+    adapter = HTTPAdapter(pool_maxsize=LOOKUP_WORKERS, max_retries=retry)
+    result = requests.Session()
+    result.mount('https://', adapter)
+    return result
+
+
 def lookup_uniprot_organism(organism_id: str) -> dict:
     """Query Uniprot for an organism by ID.
 
@@ -96,21 +326,179 @@ def lookup_uniprot_organism(organism_id: str) -> dict:
     result = None
     base_url = 'https://rest.uniprot.org/taxonomy/'
     query_url = f'{base_url}{organism_id}.json'
-    response = urlopen(query_url)
-    result = json.loads(response.read())
+    response = uniprot_session().get(query_url, timeout=LOOKUP_TIMEOUT)
+    response.raise_for_status()
+    result = json.loads(response.content)
+    return result
+
+
+def lookup_uniprot_organisms(organism_ids) -> dict:
+    """Query Uniprot for a batch of organisms by ID.
+
+    Returns a dict mapping each of the given IDs to its entry. The
+    whole batch is fetched with one taxonomy search query, following
+    its result pages. IDs missing from the search results, such as
+    merged taxa, are looked up one at a time.
+    """
+    query_url = 'https://rest.uniprot.org/taxonomy/search'
+    params = {
+        'query': ' OR '.join(f'tax_id:{oid}' for oid in organism_ids),
+        'format': 'json',
+        'size': 500,
+    }
+    session = uniprot_session()
+    entries = {}
+
+    while query_url:
+        response = session.get(
+            query_url, params=params, timeout=LOOKUP_TIMEOUT)
+        response.raise_for_status()
+        for entry in json.loads(response.content)['results']:
+            entries[str(entry['taxonId'])] = entry
+        # The next page URL already carries the query parameters.
+        query_url = response.links.get('next', {}).get('url')
+        params = None
+
+    result = {}
+    for organism_id in organism_ids:
+        entry = entries.get(str(organism_id))
+        if entry is None:
+            entry = lookup_uniprot_organism(organism_id)
+        result[organism_id] = entry
     return result
 
 
 def load_taxonomy_db(db_file_path=TAXONOMY_DB_PATH) -> dict[str, dict]:
     """Load the taxonomy DB from a backing file and return it."""
-    with open(db_file_path, 'rb') as db_file:
+    with open(db_file_path, 'rb', buffering=PICKLE_BUFFER_SIZE) as db_file:
         result = pickle.load(db_file)
         return result
 
 
-def load_sequence_df(csv_path=SEQUENCE_CSV_PATH) -> pd.DataFrame:
-    """Load a sequence dataframe from a CSV file and return it."""
-    result = pd.read_csv(csv_path)
+def taxonomy_lineages(tax_db: dict[str, dict]) -> dict[str, tuple]:
+    """Return the lineage names of each organism in a taxonomy DB.
+
+    Each lineage is a tuple of scientific names, ordered from most
+    specific to least specific. This is the only part of a taxonomy
+    entry needed for labeling.
+    """
+    result = {
+        organism_id: tuple(t['scientificName'] for t in entry['lineage'])
+        for organism_id, entry in tax_db.items()
+    }
+    return result
+
+
+def save_lineage_table(
+        lineages: dict[str, tuple],
+        table_path=LINEAGE_TABLE_PATH,
+) -> None:
+    """Save organism lineages as a Parquet table."""
+    table = pa.table({
+        'organism_id': list(lineages.keys()),
+        'lineage': pa.array(lineages.values(), type=pa.list_(pa.string())),
+    })
+    pq.write_table(table, table_path)
+
+
+def load_lineage_table(table_path=LINEAGE_TABLE_PATH) -> dict[str, tuple]:
+    """Load organism lineages from a Parquet table and return them."""
+    table = pq.read_table(table_path, memory_map=True)
+    result = dict(zip(
+        table.column('organism_id').to_pylist(),
+        map(tuple, table.column('lineage').to_pylist()),
+    ))
+    return result
+
+
+def load_lineages(db_file_path=LINEAGE_TABLE_PATH) -> dict[str, tuple]:
+    """Load organism lineages from a lineage table or a taxonomy DB."""
+    if Path(db_file_path).suffix == '.parquet':
+        result = load_lineage_table(db_file_path)
+    else:
+        result = taxonomy_lineages(load_taxonomy_db(db_file_path))
+    return result
+
+
+def write_csv(data: pd.DataFrame, csv_path: Path) -> None:
+    """Write a dataframe to a CSV file, without its index.
+
+    Uses the Arrow CSV writer, which encodes whole columns at once
+    rather than formatting each cell in Python like `DataFrame.to_csv`.
+    """
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    pa_csv.write_csv(table, csv_path)
+
+
+def fasta_source_key(fasta_path: Path) -> str:
+    """Return a key identifying the current contents of a FASTA file.
+
+    The key is built from the file's size and modification time.
+    """
+    stat = os.stat(fasta_path)
+    result = f'{stat.st_size}-{stat.st_mtime_ns}'
+    return result
+
+
+def save_sequence_table(
+        df: pd.DataFrame,
+        seq_path=SEQUENCE_PATH,
+        source_key: str | None = None,
+) -> None:
+    """Save a sequence dataframe as a zstd-compressed Parquet table.
+
+    If `source_key` is given, it is stored in the table metadata, so a
+    later import can tell whether the table is up to date.
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if source_key is not None:
+        metadata = dict(table.schema.metadata or {})
+        metadata[SOURCE_KEY_METADATA] = source_key.encode()
+        table = table.replace_schema_metadata(metadata)
+    pq.write_table(
+        table,
+        seq_path,
+        compression='zstd',
+        use_dictionary=['db', 'organism_name'],
+    )
+
+
+def sequence_table_source_key(seq_path=SEQUENCE_PATH) -> str | None:
+    """Return the source key stored in a sequence table, if any."""
+    try:
+        metadata = pq.read_schema(seq_path).metadata or {}
+    except FileNotFoundError:
+        return None
+    result = metadata.get(SOURCE_KEY_METADATA)
+    if result is not None:
+        result = result.decode()
+    return result
+
+
+def load_sequence_df(
+        seq_path=SEQUENCE_PATH,
+        columns=None,
+        csv_path=None,
+) -> pd.DataFrame:
+    """Load a sequence dataframe from a Parquet or CSV file and return it.
+
+    If `columns` is given, only those columns are read. CSV files are
+    read with the multithreaded Arrow CSV reader, with the column types
+    of the sequence table, so empty fields are read as empty strings.
+    `csv_path` is a deprecated alias of `seq_path`.
+    """
+    if csv_path is not None:
+        _warn_renamed('csv_path', 'seq_path')
+        seq_path = csv_path
+    if Path(seq_path).suffix == '.parquet':
+        result = pd.read_parquet(seq_path, columns=columns)
+    else:
+        convert_options = pa_csv.ConvertOptions(
+            column_types=_SEQUENCE_CSV_TYPES,
+            include_columns=columns,
+        )
+        table = pa_csv.read_csv(seq_path, convert_options=convert_options)
+        result = table.to_pandas()
     return result
 
 
@@ -120,39 +508,95 @@ class TaxonomyDatabaseBuilder:
     def __init__(
             self,
             db_file_path=TAXONOMY_DB_PATH,
-            seq_csv_path=SEQUENCE_CSV_PATH,
+            seq_path=SEQUENCE_PATH,
             recreate=False,
+            seq_csv_path=None,
     ):
-        """Create a TaxonomyDatabaseBuilder."""
+        """Create a TaxonomyDatabaseBuilder.
+
+        `seq_csv_path` is a deprecated alias of `seq_path`.
+        """
+        if seq_csv_path is not None:
+            _warn_renamed('seq_csv_path', 'seq_path')
+            seq_path = seq_csv_path
 
         self.db_file_path = db_file_path
-        self.seq_csv_path = seq_csv_path
+        self.journal_path = Path(f'{db_file_path}.journal.jsonl')
+        self.seq_path = seq_path
         self.init_db(recreate=recreate)
 
-    def populate(self, save_interval=100):
-        """Populate DB from organisms in the sequence dataframe."""
+    @property
+    def seq_csv_path(self):
+        """Deprecated alias of `seq_path`."""
+        _warn_renamed('seq_csv_path', 'seq_path')
+        return self.seq_path
+
+    def populate(
+            self,
+            save_interval=100,
+            max_workers=LOOKUP_WORKERS,
+            batch_size=LOOKUP_BATCH_SIZE,
+    ):
+        """Populate DB from organisms in the sequence dataframe.
+
+        Organisms missing from the DB are looked up in batches of
+        `batch_size`, with up to `max_workers` batch queries to Uniprot
+        in flight at once. Every `save_interval` new organisms are
+        appended to the journal by a background thread while lookups
+        continue, and any remaining ones are appended when lookups stop,
+        even on error. The full DB is saved once at the end.
+        """
 
-        seq_df = pd.read_csv(self.seq_csv_path)
+        seq_df = load_sequence_df(self.seq_path, columns=['organism_id'])
         n_seq = len(seq_df)
+        organism_ids = seq_df['organism_id'].drop_duplicates()
+        pending = organism_ids[~organism_ids.isin(self.db.keys())].tolist()
+        batches = [
+            pending[start:start + batch_size]
+            for start in range(0, len(pending), batch_size)
+        ]
+        unsaved = []
+        checkpoint = None
         count = 0
         prev_count = 0
 
         print(f'Populating taxonomy DB from {n_seq} sequence entries.')
 
-        for organism_id in seq_df['organism_id']:
-
-            if organism_id not in self.db:
-                entry = lookup_uniprot_organism(organism_id)
-                self.db[organism_id] = entry
-                count += 1
-
-            if count > prev_count and count % save_interval == 0:
-                self.save()
-                entry_count = count - prev_count
-                prev_count = count
-                print(f'{entry_count} organisms added to taxonomy DB.')
-
-        self.save()
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        checkpoint_executor = ThreadPoolExecutor(max_workers=1)
+        with timed('Organism lookups'):
+            try:
+                results = executor.map(lookup_uniprot_organisms, batches)
+                for batch, entries in zip(batches, results):
+                    for organism_id in batch:
+                        entry = entries[organism_id]
+                        self.db[organism_id] = entry
+                        unsaved.append((organism_id, entry))
+                        count += 1
+
+                        if count % save_interval == 0:
+                            # Keep at most one checkpoint in flight.
+                            if checkpoint is not None:
+                                checkpoint.result()
+                            checkpoint = checkpoint_executor.submit(
+                                self.checkpoint, unsaved)
+                            unsaved = []
+                            entry_count = count - prev_count
+                            prev_count = count
+                            print(f'{entry_count} organisms added to '
+                                  f'taxonomy DB.')
+            finally:
+                executor.shutdown(cancel_futures=True)
+                checkpoint_executor.shutdown()
+                if checkpoint is not None:
+                    checkpoint.result()
+                # Journal the last partial interval too, so an
+                # interrupted run keeps every organism it fetched.
+                if unsaved:
+                    self.checkpoint(unsaved)
+
+        with timed('Taxonomy DB save'):
+            self.save()
         db_size = len(self.db)
         print(f'{count} organisms added to taxonomy DB.')
         print(f'Taxonomy DB contains {db_size} total organisms.')
@@ -180,10 +624,91 @@ class TaxonomyDatabaseBuilder:
 
         self.db = db
 
+        if recreate is False:
+            n_recovered = self.replay_journal()
+            if n_recovered:
+                print(f'Recovered {n_recovered} organisms from '
+                      f'{self.journal_path}')
+        else:
+            self.journal_path.unlink(missing_ok=True)
+
+    def checkpoint(self, entries):
+        """Append (organism_id, entry) pairs to the journal file.
+
+        Each pair is written as one line of JSON. This only writes the
+        new entries, so it stays cheap as the DB grows. The journal is
+        replayed by `init_db` if populating is interrupted before the
+        next `save`.
+        """
+        with open(self.journal_path, 'a') as journal:
+            for organism_id, entry in entries:
+                journal.write(json.dumps([organism_id, entry]) + '\n')
+
+    def replay_journal(self):
+        """Add entries from the journal file to the DB.
+
+        Returns the number of entries recovered. A torn final entry,
+        e.g. from a run killed mid-write, is cut from the journal, so
+        entries appended by the next run are replayed after it.
+        """
+        count = 0
+        try:
+            journal = open(self.journal_path, 'r+b')
+        except FileNotFoundError:
+            return count
+
+        with journal:
+            good_size = 0
+            for line in journal:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    organism_id, entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                self.db[organism_id] = entry
+                good_size += len(line)
+                count += 1
+            journal.truncate(good_size)
+        return count
+
     def save(self):
-        """Save DB to backing file."""
-        with open(self.db_file_path, 'wb') as db_file:
-            pickle.dump(self.db, db_file)
+        """Save DB to backing file and clear the journal."""
+        with open(self.db_file_path, 'wb',
+                  buffering=PICKLE_BUFFER_SIZE) as db_file:
+            pickle.dump(self.db, db_file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.journal_path.unlink(missing_ok=True)
+
+
+def classify_lineage(lineage) -> str:
+    """Return the label for a lineage of scientific names.
+
+    The lineage is ordered from most specific to least specific, as
+    returned by `Labeler.lineage_by_name`. The names are walked once,
+    and the result matches the `Labeler.is_*` checks.
+    """
+    last = lineage[-1] if lineage else None
+    second_last = lineage[-2] if len(lineage) >= 2 else None
+
+    result = "Eukaryota"
+    if last == "Viruses":
+        result = "Viruses"
+    elif last == "cellular organisms":
+        if second_last == "Bacteria":
+            result = "Bacteria"
+        elif second_last == "Archaea":
+            result = "Archaea"
+        elif second_last == "Eukaryota":
+            names = set(lineage)
+            if "Viridiplantae" in names:
+                result = "Viridiplantae"
+            elif "Fungi" in names:
+                result = "Fungi"
+            elif "Chordata" in names:
+                result = "Chordata"
+            elif "Metazoa" in names:
+                result = "Metazoa"
+    return result
 
 
 class Labeler:
@@ -191,21 +716,47 @@ class Labeler:
 
     def __init__(
             self,
-            db_file_path=TAXONOMY_DB_PATH,
-            seq_csv_path=SEQUENCE_CSV_PATH,
+            db_file_path=LINEAGE_TABLE_PATH,
+            seq_path=SEQUENCE_PATH,
+            seq_csv_path=None,
     ):
-        """Create a Labeler."""
-        self.tax_db = load_taxonomy_db(db_file_path)
-        self.seq_df = load_sequence_df(seq_csv_path)
+        """Create a Labeler.
+
+        `db_file_path` is either a Parquet lineage table or a full
+        taxonomy DB pickle, and `seq_path` is a Parquet or CSV
+        sequence table. `seq_csv_path` is a deprecated alias of
+        `seq_path`.
+        """
+        if seq_csv_path is not None:
+            _warn_renamed('seq_csv_path', 'seq_path')
+            seq_path = seq_csv_path
+        self.db_file_path = db_file_path
+        self.lineages = load_lineages(db_file_path)
+        self.seq_df = load_sequence_df(seq_path)
+        self._tax_db = None
+
+    @property
+    def tax_db(self):
+        """Deprecated: the full taxonomy DB, loaded on first use.
+
+        Labeling only needs `lineages`. The full DB is only available
+        when the Labeler was created from a taxonomy DB pickle.
+        """
+        _warn_renamed('tax_db', 'lineages')
+        if Path(self.db_file_path).suffix == '.parquet':
+            raise AttributeError(
+                f'{self.db_file_path} is a lineage table, not a taxonomy DB')
+        if self._tax_db is None:
+            self._tax_db = load_taxonomy_db(self.db_file_path)
+        return self._tax_db
 
     def lineage_by_name(self, organism_id):
-        """Return the lineage as a list of scientific names.
+        """Return the lineage as a tuple of scientific names.
 
-        The returned list is ordered from most specific to least
-        specific.
+        The returned tuple is ordered from most specific to least
+        specific. It is shared with the Labeler, so it is immutable.
         """
-        entry = self.tax_db[organism_id]
-        result = [t['scientificName'] for t in entry['lineage']]
+        result = self.lineages[organism_id]
         return result
 
     def has_lineage(self, organism_id, tax_name, tax_rank=None):
@@ -283,49 +834,77 @@ class Labeler:
     @cache
     def label_organism(self, organism_id):
         """Return the label for an organism."""
-        result = None
-        if self.is_virus(organism_id):
-            result = "Viruses"
-        elif self.is_bacteria(organism_id):
-            result = "Bacteria"
-        elif self.is_archaea(organism_id):
-            result = "Archaea"
-        elif self.is_viridiplantae(organism_id):
-            result = "Viridiplantae"
-        elif self.is_fungi(organism_id):
-            result = "Fungi"
-        elif self.is_chordata(organism_id):
-            result = "Chordata"
-        elif self.is_metazoa(organism_id):
-            result = "Metazoa"
-        else:
-            result = "Eukaryota"
+        result = classify_lineage(self.lineage_by_name(organism_id))
         return result
 
-    def label_sequences(self):
-        """Label sequence data."""
-        labels = self.seq_df['organism_id'].map(self.label_organism)
-        self.seq_df['label'] = labels
+    def label_sequences(self, processes=1):
+        """Label sequence data.
+
+        Each distinct organism is labeled once, and the labels are then
+        mapped onto the sequence rows. If `processes` is greater than 1,
+        the organisms are classified by a pool of that many processes.
+        Only their lineages are sent to the workers.
+        """
+        organism_ids = self.seq_df['organism_id']
+        unique_ids = organism_ids.unique()
+
+        if processes > 1:
+            lineages = [self.lineage_by_name(oid) for oid in unique_ids]
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                labels = list(executor.map(classify_lineage, lineages))
+        else:
+            labels = [self.label_organism(oid) for oid in unique_ids]
+
+        label_map = dict(zip(unique_ids, labels))
+        self.seq_df['label'] = organism_ids.map(label_map)
 
 
 def build_taxonomy_db(
         db_file_path=TAXONOMY_DB_PATH,
-        seq_csv_path=SEQUENCE_CSV_PATH
+        seq_path=SEQUENCE_PATH,
+        lineage_table_path=LINEAGE_TABLE_PATH,
+        seq_csv_path=None,
 ):
-    """Create the taxonomy database."""
-    db_builder = TaxonomyDatabaseBuilder(db_file_path, seq_csv_path)
+    """Create the taxonomy database and its lineage table.
+
+    `seq_csv_path` is a deprecated alias of `seq_path`.
+    """
+    if seq_csv_path is not None:
+        _warn_renamed('seq_csv_path', 'seq_path')
+        seq_path = seq_csv_path
+    db_builder = TaxonomyDatabaseBuilder(db_file_path, seq_path)
     db_builder.populate(save_interval=100)
     print(f'Saved taxonomy DB to {db_file_path}')
 
+    save_lineage_table(taxonomy_lineages(db_builder.db), lineage_table_path)
+    print(f'Saved lineage table to {lineage_table_path}')
 
-def import_fasta_to_csv():
-    """Test function"""
-    df = parse_fasta_df(FASTA_FILE_PATH)
+
+def import_fasta():
+    """Parse the Uniprot FASTA data and save it as a sequence table.
+
+    Parsing is skipped if the sequence table was already built from the
+    current FASTA file.
+    """
+    source_key = fasta_source_key(FASTA_FILE_PATH)
+    if sequence_table_source_key(SEQUENCE_PATH) == source_key:
+        print(f'{SEQUENCE_PATH} is up to date with {FASTA_FILE_PATH}')
+        return
+
+    with timed('FASTA parse'):
+        df = parse_fasta_df(FASTA_FILE_PATH)
     entry_count = len(df)
     print(f'Parsed {entry_count} entries.')
 
-    df.to_csv('data/seq.csv', index=False)
-    print('Saved data to data/seq.csv')
+    with timed('Sequence table save'):
+        save_sequence_table(df, SEQUENCE_PATH, source_key)
+    print(f'Saved data to {SEQUENCE_PATH}')
+
+
+def import_fasta_to_csv():
+    """Deprecated alias of `import_fasta`."""
+    _warn_renamed('import_fasta_to_csv', 'import_fasta')
+    import_fasta()
 
 
 def create_test_data(data_dir='test/cs747/data') -> None:
@@ -335,8 +914,7 @@ def create_test_data(data_dir='test/cs747/data') -> None:
     seq_csv_path = data_dir / 'seq.csv'
     tax_db_file_path = data_dir / 'taxonomy_db.pickle'
 
-    seq_df = parse_fasta_df(fasta_file_path)
-    seq_df.to_csv(seq_csv_path, index=False)
+    fasta_to_csv_stream(fasta_file_path, seq_csv_path)
 
     builder = TaxonomyDatabaseBuilder(
         tax_db_file_path, seq_csv_path, recreate=True)
@@ -346,8 +924,8 @@ def create_test_data(data_dir='test/cs747/data') -> None:
 
 def label_sequences():
     """Label and balance the sequence data."""
-    labeler = Labeler(TAXONOMY_DB_PATH, SEQUENCE_CSV_PATH)
-    print(f"Labeling sequence data from {SEQUENCE_CSV_PATH}")
+    labeler = Labeler(LINEAGE_TABLE_PATH, SEQUENCE_PATH)
+    print(f"Labeling sequence data from {SEQUENCE_PATH}")
     labeler.label_sequences()
 
     print("Label statistics:")
@@ -356,8 +934,8 @@ def label_sequences():
 
     print("Balancing data")
     balanced = generate_balanced_data(labeler.seq_df)
-    balanced.to_csv('data/labeled_sequences.csv', index=False)
-    print("Wrote labeled data to data/labeled_sequences.csv")
+    write_csv(balanced, LABELED_CSV_PATH)
+    print(f"Wrote labeled data to {LABELED_CSV_PATH}")
 
     print("Balanced data statistics:")
     balanced_stats = build_percentage_label_stats(balanced)
@@ -393,8 +971,19 @@ def generate_balanced_data(
         data: pd.DataFrame,
         header: str = "label",
         frac_population: float = 0.01639,
+        seed: int | None = None,
 ) -> pd.DataFrame:
-    """Genereate a balanced dataset based on the fraction of the population."""
+    """Genereate a balanced dataset based on the fraction of the population.
+
+    Samples `sample_size` rows of each label without replacement, by
+    drawing row positions per label rather than through a groupby.
+    """
     sample_size = round(frac_population * len(data))
-    output_df = data.groupby(header).sample(sample_size)
+    codes, labels = pd.factorize(data[header], sort=True)
+    rng = np.random.default_rng(seed)
+    positions = [
+        rng.choice(np.flatnonzero(codes == code), sample_size, replace=False)
+        for code in range(len(labels))
+    ]
+    output_df = data.iloc[np.concatenate(positions) if positions else []]
     return output_df
@@ -6,6 +6,12 @@ import pytest
 from cs747.uniprot import Labeler, load_sequence_df, load_taxonomy_db
 
 
+@pytest.fixture
+def fasta_path() -> Path:
+    """Return a path to a sample Uniprot FASTA file."""
+    return Path('test/cs747/data/uniprot_sprot.fasta')
+
+
 @pytest.fixture
 def sequence_csv_path() -> Path:
     """Return a path to a sample sequence CSV file."""
@@ -1,14 +1,37 @@
 """Test Uniprot data utilities.
 
 """
+from io import BytesIO, StringIO
 from tempfile import NamedTemporaryFile
+import gzip
+import json
 
+from Bio.SeqIO.FastaIO import SimpleFastaParser
+import pandas as pd
+import pytest
+
+from cs747 import uniprot
 from cs747.uniprot import (
+    ARROW_STRING_DTYPE,
     Labeler,
     TaxonomyDatabaseBuilder,
+    classify_lineage,
+    fasta_source_key,
+    fasta_to_csv_stream,
+    generate_balanced_data,
+    iter_fasta_records,
+    load_sequence_df,
     load_taxonomy_db,
     lookup_uniprot_organism,
+    lookup_uniprot_organisms,
+    parse_fasta_df,
     parse_fasta_header,
+    save_lineage_table,
+    save_sequence_table,
+    sequence_table_source_key,
+    taxonomy_lineages,
+    timed,
+    write_csv,
 )
 
 
@@ -25,6 +48,31 @@ def test_parse_fasta_header():
     assert fields.organism_id == '654924'
 
 
+def test_parse_fasta_header_fallback():
+    """Test parsing headers with irregular spacing."""
+    s1 = 'sp|P00001|TEST_HUMAN OS=Homo sapiens OX=9606 PE=1 SV=1'
+    fields = parse_fasta_header(s1)
+    assert fields.entry_name == 'TEST_HUMAN'
+    assert fields.protein_name == ''
+    assert fields.organism_name == 'Homo sapiens'
+    assert fields.organism_id == '9606'
+
+    s2 = 'sp|P00002|TEST_HUMAN  Test protein  OS=Homo sapiens  OX=9606'
+    fields = parse_fasta_header(s2)
+    assert fields.protein_name == 'Test protein'
+    assert fields.organism_name == 'Homo sapiens'
+    assert fields.organism_id == '9606'
+
+    s3 = 'sp|P00003|TEST_HUMAN\tTest protein\tOS=Homo sapiens\tOX=9606'
+    fields = parse_fasta_header(s3)
+    assert fields.protein_name == 'Test protein'
+    assert fields.organism_name == 'Homo sapiens'
+    assert fields.organism_id == '9606'
+
+    with pytest.raises(ValueError):
+        parse_fasta_header('sp|P00003|TEST_HUMAN Test protein')
+
+
 def test_lookup_uniprot_organism():
     """Test lookup of an organism entry on Uniprot."""
     organism_id = '402880'
@@ -34,6 +82,65 @@ def test_lookup_uniprot_organism():
     assert entry['lineage'][-2]['scientificName'] == "Archaea"
 
 
+def test_lookup_uniprot_organisms():
+    """Test batch lookup of organism entries on Uniprot."""
+    organism_ids = ['402880', '9606']
+    entries = lookup_uniprot_organisms(organism_ids)
+    assert list(entries) == organism_ids
+    assert entries['402880']['scientificName'] == (
+        "Methanococcus maripaludis (strain C5 / ATCC BAA-1333)")
+    assert entries['9606']['lineage'][-2]['scientificName'] == "Eukaryota"
+
+
+class FakeResponse:
+    """A canned Uniprot REST response."""
+
+    def __init__(self, data, next_url=None):
+        self.content = json.dumps(data).encode()
+        self.links = {'next': {'url': next_url}} if next_url else {}
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession:
+    """A Uniprot session that answers from canned responses."""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def get(self, url, params=None, timeout=None):
+        assert timeout is not None
+        self.requests.append((url, params))
+        return self.responses[url]
+
+
+def test_lookup_uniprot_organisms_offline(monkeypatch, taxonomy_db):
+    """Test batch lookup with paged results and a missing organism."""
+    search_url = 'https://rest.uniprot.org/taxonomy/search'
+    next_url = f'{search_url}?cursor=2'
+    first, second, merged = list(taxonomy_db)[:3]
+    merged_url = f'https://rest.uniprot.org/taxonomy/{merged}.json'
+    session = FakeSession({
+        search_url: FakeResponse(
+            {'results': [taxonomy_db[first]]}, next_url=next_url),
+        next_url: FakeResponse({'results': [taxonomy_db[second]]}),
+        merged_url: FakeResponse(taxonomy_db[merged]),
+    })
+    monkeypatch.setattr('cs747.uniprot.uniprot_session', lambda: session)
+
+    organism_ids = [first, second, merged]
+    entries = lookup_uniprot_organisms(organism_ids)
+    assert list(entries) == organism_ids
+    assert entries == {oid: taxonomy_db[oid] for oid in organism_ids}
+    assert [url for url, _ in session.requests] == [
+        search_url, next_url, merged_url]
+    assert session.requests[0][1]['query'] == (
+        f'tax_id:{first} OR tax_id:{second} OR tax_id:{merged}')
+    assert session.requests[1][1] is None
+
+
 def test_create_taxonomy_db(sequence_csv_path, taxonomy_db):
     """Test taxonomy DB creation."""
     tmp_file = NamedTemporaryFile(prefix='cs747.test-')
@@ -51,6 +158,7 @@ def test_init_labeler(taxonomy_db_path, sequence_csv_path):
     labeler = Labeler(taxonomy_db_path, sequence_csv_path)
     assert hasattr(labeler, 'seq_df')
     assert hasattr(labeler, 'tax_db')
+    assert hasattr(labeler, 'lineages')
 
 
 def test_label_viruses(labeler):
@@ -97,3 +205,248 @@ def test_label_sequences(labeler):
     assert results["Chordata"] == ['Homo sapiens']
     assert results["Metazoa"] == ['Drosophila melanogaster']
     assert results["Eukaryota"] == ['Dictyostelium discoideum']
+
+
+def test_fasta_to_csv_stream(tmp_path, fasta_path, sequence_csv_path):
+    """Test streaming FASTA entries to a sequence CSV."""
+    csv_path = tmp_path / 'seq.csv'
+
+    count = fasta_to_csv_stream(fasta_path, csv_path)
+    assert count == 8
+    assert load_sequence_df(csv_path).equals(
+        load_sequence_df(sequence_csv_path))
+
+
+def test_parse_fasta_df(tmp_path, fasta_path, sequence_df):
+    """Test parsing FASTA data into a dataframe."""
+    df = parse_fasta_df(fasta_path)
+    assert list(df.columns) == list(sequence_df.columns)
+    assert (df.astype(str).values == sequence_df.astype(str).values).all()
+    assert df['db'].dtype == 'category'
+    assert df['organism_name'].dtype == 'category'
+    assert df['sequence'].dtype == ARROW_STRING_DTYPE
+
+    odd_path = tmp_path / 'odd.fasta'
+    with open(odd_path, 'w') as odd_file:
+        odd_file.write(fasta_path.read_text())
+        odd_file.write('>sp|P00001|TEST_HUMAN\tOS=Homo sapiens OX=9606\nMA\n')
+        odd_file.write('>sp|P00002|TEST_HUMAN OS=Homo sapiens OX=9606\nMA\n')
+        odd_file.write('>sp|P00003|E Prot HOS=1 x OS=Homo OX=9606\nMA\n')
+
+    df = parse_fasta_df(odd_path)
+    assert len(df) == 11
+    assert df.iloc[-3].astype(str).to_list() == [
+        'sp', 'P00001', 'TEST_HUMAN', '', 'Homo sapiens', '9606', 'MA']
+    assert df.iloc[-2].astype(str).to_list() == [
+        'sp', 'P00002', 'TEST_HUMAN', '', 'Homo sapiens', '9606', 'MA']
+    assert df.iloc[-1].astype(str).to_list() == [
+        'sp', 'P00003', 'E', 'Prot HOS=1 x', 'Homo', '9606', 'MA']
+    assert df.iloc[-1, :-1].astype(str).to_list() == list(
+        parse_fasta_header('sp|P00003|E Prot HOS=1 x OS=Homo OX=9606'))
+
+
+def test_parse_gzip_fasta(tmp_path, fasta_path):
+    """Test reading gzip-compressed FASTA data."""
+    gz_path = tmp_path / 'uniprot_sprot.fasta.gz'
+    with gzip.open(gz_path, 'wb') as gz_file:
+        gz_file.write(fasta_path.read_bytes())
+
+    df = parse_fasta_df(gz_path)
+    assert df.equals(parse_fasta_df(fasta_path))
+
+
+def test_populate_taxonomy_db(
+        monkeypatch, tmp_path, sequence_csv_path, taxonomy_db):
+    """Test taxonomy DB population without querying Uniprot."""
+    monkeypatch.setattr(
+        'cs747.uniprot.lookup_uniprot_organisms',
+        lambda ids: {oid: taxonomy_db[oid] for oid in ids},
+    )
+    db_file_path = tmp_path / 'taxonomy_db.pickle'
+
+    builder = TaxonomyDatabaseBuilder(db_file_path, sequence_csv_path)
+    builder.populate(save_interval=3, max_workers=4, batch_size=3)
+    assert builder.db == taxonomy_db
+    assert load_taxonomy_db(db_file_path) == taxonomy_db
+
+
+def test_resume_taxonomy_db(
+        monkeypatch, tmp_path, sequence_csv_path, taxonomy_db):
+    """Test resuming an interrupted taxonomy DB build from its journal."""
+    failing_ids = [list(taxonomy_db)[5]]
+
+    def flaky_lookup(organism_ids):
+        if failing_ids and failing_ids[0] in organism_ids:
+            raise ConnectionError(failing_ids[0])
+        return {oid: taxonomy_db[oid] for oid in organism_ids}
+
+    monkeypatch.setattr('cs747.uniprot.lookup_uniprot_organisms', flaky_lookup)
+    db_file_path = tmp_path / 'taxonomy_db.pickle'
+
+    builder = TaxonomyDatabaseBuilder(db_file_path, sequence_csv_path)
+    with pytest.raises(ConnectionError):
+        builder.populate(save_interval=2, max_workers=1, batch_size=1)
+    with open(builder.journal_path, 'a') as journal:
+        journal.write('[9606, {"scientificName": "Ho')
+
+    # Interrupt the resumed run too, so its entries are journaled after
+    # the torn line left by the first run.
+    failing_ids[0] = list(taxonomy_db)[7]
+    builder = TaxonomyDatabaseBuilder(db_file_path, sequence_csv_path)
+    assert len(builder.db) == 5
+    with pytest.raises(ConnectionError):
+        builder.populate(save_interval=2, max_workers=1, batch_size=1)
+
+    failing_ids.clear()
+    builder = TaxonomyDatabaseBuilder(db_file_path, sequence_csv_path)
+    assert len(builder.db) == 7
+    builder.populate()
+    assert load_taxonomy_db(db_file_path) == taxonomy_db
+    assert not builder.journal_path.exists()
+
+
+def test_classify_lineage():
+    """Test labeling a lineage of scientific names."""
+    chordata = ['Homo', 'Chordata', 'Metazoa', 'Eukaryota',
+                'cellular organisms']
+    metazoa = ['Drosophila', 'Arthropoda', 'Metazoa', 'Eukaryota',
+               'cellular organisms']
+    assert classify_lineage(chordata) == 'Chordata'
+    assert classify_lineage(metazoa) == 'Metazoa'
+    assert classify_lineage(['Ranavirus', 'Viruses']) == 'Viruses'
+    assert classify_lineage(['Bacteria', 'cellular organisms']) == 'Bacteria'
+    assert classify_lineage(['cellular organisms']) == 'Eukaryota'
+    assert classify_lineage([]) == 'Eukaryota'
+
+
+def test_lineage_table(tmp_path, taxonomy_db, sequence_csv_path, labeler):
+    """Test labeling from a saved lineage table."""
+    table_path = tmp_path / 'taxonomy_lineage.parquet'
+
+    lineages = taxonomy_lineages(taxonomy_db)
+    save_lineage_table(lineages, table_path)
+    table_labeler = Labeler(table_path, sequence_csv_path)
+    assert table_labeler.lineages == lineages
+    assert table_labeler.lineage_by_name(9606)[-1] == 'cellular organisms'
+    assert isinstance(table_labeler.lineage_by_name(9606), tuple)
+
+    table_labeler.label_sequences()
+    labeler.label_sequences()
+    assert table_labeler.seq_df.equals(labeler.seq_df)
+
+
+def test_write_csv(tmp_path, sequence_df):
+    """Test writing a dataframe to CSV."""
+    csv_path = tmp_path / 'seq.csv'
+
+    write_csv(sequence_df, csv_path)
+    assert load_sequence_df(csv_path).equals(sequence_df)
+
+
+def test_label_sequences_parallel(
+        labeler, taxonomy_db_path, sequence_csv_path):
+    """Test labeling sequence data with a process pool."""
+    parallel_labeler = Labeler(taxonomy_db_path, sequence_csv_path)
+    parallel_labeler.label_sequences(processes=2)
+    labeler.label_sequences()
+    assert parallel_labeler.seq_df['label'].equals(labeler.seq_df['label'])
+
+
+def test_generate_balanced_data(labeler):
+    """Test sampling the same number of sequences for each label."""
+    labeler.label_sequences()
+    seq_df = pd.concat([labeler.seq_df] * 3, ignore_index=True)
+
+    balanced = generate_balanced_data(seq_df, frac_population=2 / 24)
+    assert balanced['label'].value_counts().to_dict() == {
+        label: 2 for label in seq_df['label'].unique()
+    }
+    assert not balanced.index.duplicated().any()
+
+    first = generate_balanced_data(seq_df, frac_population=2 / 24, seed=0)
+    second = generate_balanced_data(seq_df, frac_population=2 / 24, seed=0)
+    assert first.equals(second)
+
+
+@pytest.mark.parametrize('buffer_size', [1, 7, 64, 4096])
+def test_iter_fasta_records(monkeypatch, fasta_path, buffer_size):
+    """Test the bytes-level FASTA reader across chunk boundaries."""
+    monkeypatch.setattr('cs747.uniprot.FASTA_BUFFER_SIZE', buffer_size)
+    text = fasta_path.read_text()
+    samples = [
+        text,
+        'comment line\n' + text,
+        text.replace('\n', '\r\n'),
+        '>empty\n>no newline\nACDE',
+        '',
+    ]
+    for sample in samples:
+        records = list(iter_fasta_records(BytesIO(sample.encode())))
+        expected = list(SimpleFastaParser(StringIO(sample)))
+        assert [(t.decode(), s.decode()) for t, s in records] == expected
+
+
+def test_sequence_parquet(
+        tmp_path, fasta_path, taxonomy_db_path, sequence_df, labeler):
+    """Test labeling sequences saved as Parquet."""
+    seq_path = tmp_path / 'seq.parquet'
+
+    assert sequence_table_source_key(seq_path) is None
+    save_sequence_table(
+        parse_fasta_df(fasta_path), seq_path, fasta_source_key(fasta_path))
+    assert sequence_table_source_key(seq_path) == fasta_source_key(fasta_path)
+    seq_df = load_sequence_df(seq_path)
+    assert seq_df['organism_id'].equals(sequence_df['organism_id'])
+    assert load_sequence_df(seq_path, columns=['organism_id']).equals(
+        sequence_df[['organism_id']])
+
+    parquet_labeler = Labeler(taxonomy_db_path, seq_path)
+    parquet_labeler.label_sequences()
+    labeler.label_sequences()
+    assert parquet_labeler.seq_df['label'].equals(labeler.seq_df['label'])
+
+
+def test_load_sequence_csv_empty_column(tmp_path, sequence_df):
+    """Test reading a sequence CSV whose protein names are all empty."""
+    csv_path = tmp_path / 'seq.csv'
+    write_csv(sequence_df.assign(protein_name=''), csv_path)
+
+    seq_df = load_sequence_df(csv_path)
+    assert seq_df['protein_name'].dtype == sequence_df['entry_name'].dtype
+    assert (seq_df['protein_name'] == '').all()
+    assert seq_df['organism_id'].equals(sequence_df['organism_id'])
+
+
+def test_timed(capsys):
+    """Test timing a block of code."""
+    with timed('Test step'):
+        pass
+    output = capsys.readouterr().out
+    assert output.startswith('Test step: ')
+    assert ' ms, RSS ' in output
+    assert output.endswith(' MiB)\n')
+
+
+def test_deprecated_sequence_path_names(
+        monkeypatch, taxonomy_db_path, sequence_csv_path, sequence_df):
+    """Test the deprecated CSV-specific sequence path names."""
+    with pytest.warns(DeprecationWarning):
+        assert uniprot.SEQUENCE_CSV_PATH == uniprot.SEQUENCE_PATH
+    with pytest.warns(DeprecationWarning):
+        seq_df = load_sequence_df(csv_path=sequence_csv_path)
+    assert seq_df.equals(sequence_df)
+    with pytest.warns(DeprecationWarning):
+        labeler = Labeler(taxonomy_db_path, seq_csv_path=sequence_csv_path)
+    assert labeler.seq_df.equals(sequence_df)
+    with pytest.warns(DeprecationWarning):
+        builder = TaxonomyDatabaseBuilder(
+            taxonomy_db_path, seq_csv_path=sequence_csv_path)
+    with pytest.warns(DeprecationWarning):
+        assert builder.seq_csv_path == sequence_csv_path
+
+    imports = []
+    monkeypatch.setattr(
+        'cs747.uniprot.import_fasta', lambda: imports.append(True))
+    with pytest.warns(DeprecationWarning):
+        uniprot.import_fasta_to_csv()
+    assert imports == [True]